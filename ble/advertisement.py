@@ -44,6 +44,7 @@ class Advertisement(dbus.service.Object):
         self.manufacturer_data = None
         self.service_data = None
         self.include_tx_power = None
+        self.registered = False
         dbus.service.Object.__init__(self, self.bus, self.path)
 
     def get_properties(self):
@@ -120,12 +121,18 @@ class Advertisement(dbus.service.Object):
     def register_ad_callback(self):
         print("GATT advertisement registered")
 
-    def register_ad_error_callback(self):
-        print("Failed to register GATT advertisement")
+    def register_ad_error_callback(self, error):
+        self.registered = False
+        print("Failed to register GATT advertisement: " + str(error))
+
+    def register(self, adapter=None):
+        if self.registered:
+            return
+        self.registered = True
 
-    def register(self):
         bus = BleTools.get_bus()
-        adapter = BleTools.find_adapter(bus)
+        if adapter is None:
+            adapter = BleTools.find_adapter(bus)
 
         ad_manager = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter),
                                 LE_ADVERTISING_MANAGER_IFACE)
@@ -28,6 +28,7 @@ except ImportError:
 BLUEZ_SERVICE_NAME = "org.bluez"
 LE_ADVERTISING_MANAGER_IFACE = "org.bluez.LEAdvertisingManager1"
 DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
+DEVICE_IFACE = "org.bluez.Device1"
 
 class BleTools(object):
     @classmethod
@@ -37,10 +38,15 @@ class BleTools(object):
          return bus
 
     @classmethod
-    def find_adapter(self, bus):
+    def get_managed_objects(self, bus):
         remote_om = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, "/"),
                                DBUS_OM_IFACE)
-        objects = remote_om.GetManagedObjects()
+        return remote_om.GetManagedObjects()
+
+    @classmethod
+    def find_adapter(self, bus, objects=None):
+        if objects is None:
+            objects = self.get_managed_objects(bus)
 
         for o, props in objects.items():
             if LE_ADVERTISING_MANAGER_IFACE in props:
@@ -48,6 +54,15 @@ class BleTools(object):
 
         return None
 
+    @classmethod
+    def find_connected_devices(self, objects):
+        devices = []
+        for o, props in objects.items():
+            if DEVICE_IFACE in props and props[DEVICE_IFACE].get("Connected"):
+                devices.append(o)
+
+        return devices
+
     @classmethod
     def power_adapter(self):
         adapter = self.get_adapter()
@@ -53,6 +53,7 @@ class Application(dbus.service.Object):
         self.path = "/"
         self.services = []
         self.next_index = 0
+        self.registered = False
         dbus.service.Object.__init__(self, self.bus, self.path)
 
     def get_path(self):
@@ -80,10 +81,18 @@ class Application(dbus.service.Object):
         print("GATT application registered")
 
     def register_app_error_callback(self, error):
+        self.registered = False
         print("Failed to register application: " + str(error))
 
-    def register(self):
-        adapter = BleTools.find_adapter(self.bus)
+    def register(self, adapter=None):
+        # BlueZ keeps our objects once registered, and every registration makes it
+        # walk them all again with GetManagedObjects
+        if self.registered:
+            return
+        self.registered = True
+
+        if adapter is None:
+            adapter = BleTools.find_adapter(self.bus)
 
         service_manager = dbus.Interface(
                 self.bus.get_object(BLUEZ_SERVICE_NAME, adapter),
@@ -147,6 +156,12 @@ class Service(dbus.service.Object):
 
         return idx
 
+    def add_timeout(self, timeout, callback):
+        return GObject.timeout_add(timeout, callback)
+
+    def remove_timeout(self, source_id):
+        GObject.source_remove(source_id)
+
     @dbus.service.method(DBUS_PROP_IFACE,
                          in_signature='s',
                          out_signature='a{sv}')
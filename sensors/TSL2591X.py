@@ -1,6 +1,6 @@
 # taken from https://forums.adafruit.com/viewtopic.php?f=19&t=175649
 
-from asyncio import sleep
+from time import monotonic, sleep
 import adafruit_tsl2591
 
 class TSL2591X(adafruit_tsl2591.TSL2591):
@@ -80,36 +80,71 @@ class TSL2591X(adafruit_tsl2591.TSL2591):
         {"gain": adafruit_tsl2591.GAIN_MAX,  "integration": adafruit_tsl2591.INTEGRATIONTIME_600MS, "lo":3277, "hi":62258},
         )
     state = 2
+    # (lo, hi) channel 0 thresholds of each state
+    thresholds = tuple((state["lo"], state["hi"]) for state in states)
+    enable_logging = False
+
+    # seconds the device needs after being re-enabled, indexed by integration time register value
+    settle_times = tuple(0.1 + 0.1 * (integration + 1) for integration in range(6))
+    # monotonic time at which the current state has settled
+    _settled_at = 0.0
+
+    # gain multipliers, indexed by gain register value >> 4
+    gain_multipliers = (1, 25, 428, 9876)
+    # lux per channel 0 count, indexed by [gain register value >> 4][integration time register value]
+    lux_factors = tuple(
+        tuple(428 / gain / (integration + 1) / 100.0 for integration in range(6))
+        for gain in gain_multipliers)
 
     # rather than override __init__ in the base class just get the device and the class in sync
-    async def begin(self):
-        await self.setstate(self.state)
+    def begin(self):
+        self.setstate(self.state)
 
-    async def setstate(self, val: int):
+    def setstate(self, val: int):
         self.gain = self.states[val]['gain']
         self.integration_time = self.states[val]['integration']
         self.state = val
+        self._lux_factor = self.lux_factors[self.states[val]['gain'] >> 4][self.states[val]['integration']]
         # disabling and enabling helps to reset the state of the sensor
         self.disable()
         self.enable()
-        await sleep(0.1 + 0.1 * (self.integration_time + 1))
+        # don't block here; the next read waits for whatever settling time is left
+        self._settled_at = monotonic() + self.settle_times[self.states[val]['integration']]
+
+    def settle(self):
+        remaining = self._settled_at - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def is_settled(self) -> bool:
+        return monotonic() >= self._settled_at
  
-    async def autorange(self, once: bool):
+    def autorange(self, once: bool):
+        state = self.state
         while (True):
+            self.settle()
             channel_0, channel_1 = self.raw_luminosity
-            # debug
-            # print(self.state, self.states[self.state]['lo'], self.states[self.state]['hi'])
-            if channel_0 > self.states[self.state]['hi'] and self.state > 0:
-                await self.setstate(self.state - 1)
-            elif channel_0 < self.states[self.state]['lo'] and self.state < (len(self.states) - 1):
-                await self.setstate(self.state + 1)
-            else:
+            next_state = self.next_state(state, channel_0)
+            if next_state == state:
                 break
-            # debug
-            print("auto state %d: %dx @ %dms %d %d" % (self.state, [1, 25, 428, 9876][self.gain >> 4], 100*(self.integration_time + 1), channel_0, channel_1))
+            self.setstate(next_state)
+            state = next_state
+            if self.enable_logging:
+                settings = self.states[state]
+                print("auto state %d: %dx @ %dms %d %d" % (state, self.gain_multipliers[settings['gain'] >> 4], 100*(settings['integration'] + 1), channel_0, channel_1))
             if once:
                 break
 
+    # pure decision step of autorange: the state to switch to for a channel 0 reading
+    @classmethod
+    def next_state(cls, state: int, channel_0: int) -> int:
+        lo, hi = cls.thresholds[state]
+        if channel_0 > hi and state > 0:
+            return state - 1
+        if channel_0 < lo and state < len(cls.thresholds) - 1:
+            return state + 1
+        return state
+
     '''
     Estimate irradiance in W/m^2
 
@@ -118,12 +153,10 @@ class TSL2591X(adafruit_tsl2591.TSL2591):
         ch1  34.9 counts/(uW/cm^2)
     '''
     def irradiance(self):
+        self.settle()
         channel_0, channel_1 = self.raw_luminosity
-        gain_correction = 428 / [1, 25, 428, 9876][self.gain >> 4]
-        integration_time_correction = 1 / (self.integration_time + 1)
-        f = gain_correction * integration_time_correction
         # we prefer lux instead of W/m^2
-        return f * channel_0 / 100.0
+        return self._lux_factor * channel_0
         # return (f * channel_0 / 26410.0)
     
 
@@ -132,5 +165,8 @@ class TSL2591X(adafruit_tsl2591.TSL2591):
         return self
     
     def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
         self.disable()
         print('Turned off brightness sensor')
@@ -1,38 +1,55 @@
-import asyncio
-import threading
-
 import board
+try:
+    from gi.repository import GObject
+except ImportError:
+    import gobject as GObject
+
 from .TSL2591X import TSL2591X
 
 
+POLL_INTERVAL = 200  # milliseconds
+
+
 class BrightnessSensor:
     
     def __init__(self):
         self.enable_logging = False
         self.value = 0
-        self.keep_running = True
-        self.thread = threading.Thread(target=self.start)
-        self.thread.start()
+        self.sensor = None
+        self.timer_id = None
+        self.start()
 
     def start(self):
-        self.keep_running = True
-        asyncio.run(self.loop())
+        # a missing light sensor shouldn't take the whole server down; get() keeps returning 0
+        try:
+            sensor = TSL2591X(board.I2C())
+            sensor.begin()
+        except Exception as e:
+            print('Exception in BrightnessSensor.start:', e)
+            return
+        self.sensor = sensor
+        self.timer_id = GObject.timeout_add(POLL_INTERVAL, self.poll)
 
     def stop(self):
-        self.keep_running = False
-
-    async def loop(self):
-        i2c = board.I2C()
-        with TSL2591X(i2c) as sensor:
-            await sensor.begin()
-            while self.keep_running:
-                try:
-                    self.value = sensor.irradiance()
-                    if self.enable_logging:
-                        print(f'brightness:{self.value:.4f}')
-                    await asyncio.gather(sensor.autorange(True), asyncio.sleep(0.2))
-                except Exception as e:
-                    print('Exception in BrightnessSensor.loop:', e)
+        if self.timer_id is not None:
+            GObject.source_remove(self.timer_id)
+            self.timer_id = None
+        if self.sensor is not None:
+            self.sensor.close()
+            self.sensor = None
+
+    def poll(self) -> bool:
+        # this runs on the main loop, so don't wait for the sensor to settle after
+        # a range change; just try again on the next poll
+        if self.sensor.is_settled():
+            try:
+                self.value = self.sensor.irradiance()
+                if self.enable_logging:
+                    print(f'brightness:{self.value:.4f}')
+                self.sensor.autorange(True)
+            except Exception as e:
+                print('Exception in BrightnessSensor.poll:', e)
+        return True
 
     def get(self):
         return self.value
@@ -41,3 +58,9 @@ class BrightnessSensor:
 if __name__ == '__main__':
     brightness_sensor = BrightnessSensor()
     brightness_sensor.enable_logging = True
+    if brightness_sensor.sensor is not None:
+        brightness_sensor.sensor.enable_logging = True
+    try:
+        GObject.MainLoop().run()
+    except KeyboardInterrupt:
+        brightness_sensor.stop()
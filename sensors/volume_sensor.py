@@ -1,31 +1,54 @@
 import math
+import queue
+from bisect import bisect_left, insort
 
 import sounddevice as sd
 import numpy as np
+try:
+    from gi.repository import GObject
+except ImportError:
+    import gobject as GObject
+
+
+POLL_INTERVAL = 200  # milliseconds
 
 
 class CircularBuffer(np.ndarray):
     def __new__(cls, max_length: int):
-        return np.zeros(max_length).view(cls)
+        # the bookkeeping belongs to this buffer only; slices, views and ufunc
+        # results are plain data and don't get it
+        buffer = np.zeros(max_length).view(cls)
+        buffer._length = 0
+        buffer._max_length = max_length
+        buffer._index = 0
+        # sorted mirror of the populated values, for order statistics
+        buffer._sorted = []
+        return buffer
 
-    def __init__(self, max_length: int):
-        self._length = 0
-        self._max_length = max_length
-        self._index = 0
-        
     def push(self, value: float):
-        if self._length < self._max_length:
+        value = float(value)
+        max_length = self._max_length
+        index = self._index
+        if self._length < max_length:
             self._length += 1
+        else:
+            # evict the value being overwritten from the sorted mirror
+            sorted_values = self._sorted
+            del sorted_values[bisect_left(sorted_values, self[index])]
+        insort(self._sorted, value)
 
-        self[self._index] = value
-        self._index += 1
-        self._index %= len(self)
+        self[index] = value
+        index += 1
+        if index == max_length:
+            index = 0
+        self._index = index
     
-    def populated_slice(self) -> np.ndarray:
-        if self._length < self._max_length:
-            return self[:self._length]
-        else:
-            return self
+    def percentile(self, percentage: float) -> float:
+        sorted_values = self._sorted
+        index = int(percentage * len(sorted_values))
+        index = max(0, index)
+        index = min(len(sorted_values) - 1, index)
+        return sorted_values[index]
 
 
 class VolumeSensor:
@@ -34,49 +57,61 @@ class VolumeSensor:
         self.buffer = CircularBuffer(100)
         self.enable_logging = False
         self.value: float = 0
+        self.timer_id = None
         self.start()
     
     def get(self):
         return self.value
     
     def start(self):
+        self.levels = queue.SimpleQueue()
         self.stream = sd.InputStream(samplerate=48000, latency=0.2, channels=1, callback=self.callback)
         self.stream.start()
+        self.timer_id = GObject.timeout_add(POLL_INTERVAL, self.poll)
     
     def stop(self):
+        if self.timer_id is not None:
+            GObject.source_remove(self.timer_id)
+            self.timer_id = None
         self.stream.stop()
         self.stream.close()
         print('Turned off microphone stream')
 
     def callback(self, indata: np.ndarray, frames, time, status):
-        sample = self.toDecibels(indata)
-        self.buffer.push(sample)
-        self.value = self.time_average(self.buffer.populated_slice(), 0.8)
-        if self.enable_logging:
-            self.print_sound(self.value)
+        # this runs on the real-time audio thread: reduce the frame to a single level,
+        # which allocates no arrays, and leave the rest to poll()
+        self.levels.put(self.toDecibels(indata))
+
+    def poll(self) -> bool:
+        # process the levels that arrived since the last poll on the main loop
+        while True:
+            try:
+                sample = self.levels.get_nowait()
+            except queue.Empty:
+                return True
+            self.buffer.push(sample)
+            self.value = self.buffer.percentile(0.8)
+            if self.enable_logging:
+                self.print_sound(self.value)
 
     @classmethod
     def rms(cls, arr: np.ndarray) -> float: # calculates root mean squared of an array of sound data
-        rms = np.sqrt(np.mean(arr ** 2))
-        return rms
+        flat = arr.ravel()
+        if flat.size == 0: # an empty frame would divide by zero below
+            return 0.0
+        sum_of_squares = float(np.dot(flat, flat)) # single pass, no squared temporary
+        return math.sqrt(sum_of_squares / flat.size)
 
     @classmethod
     def toDecibels(cls, pressure: np.ndarray) -> float:
         p = cls.rms(pressure)
-        pp0 = abs(p / 0.00002) # rms / threshold
+        pp0 = p / 0.00002 # rms / threshold
         if (pp0 > 0.00000001): # ensures the value is not too close to 0 (or is 0)
-            decibels = 20 * math.log(pp0 , 10) # converstion to decibels
+            decibels = 20 * math.log10(pp0) # converstion to decibels
         else:
             decibels = 0
         return decibels
 
-    @classmethod
-    def time_average(cls, samples: np.ndarray, percentage: float) -> float:
-        index = int(percentage * len(samples))
-        index = max(0, index)
-        index = min(len(samples) - 1, index)
-        return np.partition(samples.flatten(), index)[index]
-
     @classmethod
     def print_sound(cls, level: float):
         print('{: >5.1f}'.format(level), '|' * max(0, int(level)))
@@ -86,7 +121,6 @@ if __name__ == '__main__':
     sensor = VolumeSensor()
     sensor.enable_logging = True
     try:
-        while sensor.stream.active:
-            sd.sleep(100)
+        GObject.MainLoop().run()
     except KeyboardInterrupt:
         sensor.stop()
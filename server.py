@@ -1,68 +1,79 @@
 #!/usr/bin/python3
 
-from time import time
+from functools import partial
+import logging
+import signal
 import sys
 
 import dbus
 
 from ble.advertisement import Advertisement
+from ble.bletools import BleTools, DBUS_OM_IFACE, DEVICE_IFACE
 from ble.service import Application, Service, Characteristic, Descriptor
+from ble.service import DBUS_PROP_IFACE, GATT_CHRC_IFACE
 
 from sensors.brightness_sensor import BrightnessSensor
 from sensors.volume_sensor import VolumeSensor
 
 
-GATT_CHRC_IFACE = 'org.bluez.GattCharacteristic1'
-NOTIFY_TIMEOUT = 500
+NOTIFY_TIMEOUT = 1000
+# a characteristic whose value stays put is checked at most every this many ticks
+MAX_NOTIFY_BACKOFF = 5
+# PropertiesChanged never invalidates anything, so share one empty list
+NO_INVALIDATED = dbus.Array([], signature='s')
 
 
-def encode(string: str) -> 'list[dbus.Byte]':
-    encoded = string.encode('utf-8')
-    byte_array = [dbus.Byte(b) for b in encoded]
-    return byte_array
+def encode(string: str) -> dbus.ByteArray:
+    # a ByteArray is a single bytes object that dbus-python marshals as 'ay'
+    return dbus.ByteArray(string.encode('utf-8'))
 
 
-def decode(byte_array: 'list[dbus.Byte]') -> str:
-    encoded = bytearray([int(b) for b in byte_array])
-    return encoded.decode('utf-8')
+def should_notify(previous: float, current: float,
+                  min_change: float, min_relative_change: float = 0.0) -> bool:
+    return abs(previous - current) > min_change + min_relative_change * previous
 
 
 brightness_sensor = BrightnessSensor()
 volume_sensor = VolumeSensor()
 # brightness_sensor.enable_logging = True
 # volume_sensor.enable_logging = True
-verbose = False
+logger = logging.getLogger(__name__)
 
 class TextDescriptor(Descriptor):
     DESCRIPTOR_UUID = '2901'
 
     def __init__(self, characteristic, description):
         self.description = description
+        # the description never changes, so encode it once
+        self.encoded_description = encode(description)
         super().__init__(
                 self.DESCRIPTOR_UUID,
                 ['read'],
                 characteristic)
 
     def ReadValue(self, options):
-        return encode(self.description)
+        return self.encoded_description
 
 
 class NsAdvertisement(Advertisement):
     # we use this to identify that the device is indeed an ns_server
     MANUFACTURER_UNIQUE_IDENTIFIER = '$tZuFTNvsLGt9U^gsCM!t8$@Fd6'
+    MANUFACTURER_DATA = encode(MANUFACTURER_UNIQUE_IDENTIFIER)
 
     def __init__(self, index):
         super().__init__(index, 'peripheral')
         self.add_local_name('ns_server')
-        self.add_manufacturer_data(0xffff, encode(self.MANUFACTURER_UNIQUE_IDENTIFIER))
+        self.add_manufacturer_data(0xffff, self.MANUFACTURER_DATA)
         self.include_tx_power = True
 
 
 class NsService(Service):
     SVC_UUID = '00000000-b1b6-417b-af10-da8b3de984be'
 
-    def __init__(self, index):
-        self.volume_update_paused_until = False
+    def __init__(self, index, connected_devices=None):
+        self.volume_update_paused = False
+        self.resume_timer_id = None
+        self.notify_timer_id = None
 
         super().__init__(index, self.SVC_UUID, True)
         self.brightness = BrightnessCharacteristic(self)
@@ -73,30 +84,170 @@ class NsService(Service):
         self.add_characteristic(self.volume)
         self.add_characteristic(self.pause)
 
+        # follow which centrals are connected, so we don't emit notifications for nobody
+        # while subscriptions stay open; BlueZ keeps a bonded central's subscription
+        # across reconnects, so StartNotify/StopNotify are left entirely to BlueZ.
+        # None means we don't know who is connected, and then notifications aren't held back.
+        self.connected_devices = None if connected_devices is None else set(connected_devices)
+        self.bus.add_signal_receiver(
+                self._device_properties_changed,
+                dbus_interface=DBUS_PROP_IFACE,
+                signal_name='PropertiesChanged',
+                arg0=DEVICE_IFACE,
+                path_keyword='path')
+        # a central BlueZ hasn't seen before appears as a new, already connected object
+        self.bus.add_signal_receiver(
+                self._interfaces_added,
+                dbus_interface=DBUS_OM_IFACE,
+                signal_name='InterfacesAdded')
+        self.bus.add_signal_receiver(
+                self._interfaces_removed,
+                dbus_interface=DBUS_OM_IFACE,
+                signal_name='InterfacesRemoved')
+
+    def _set_connected(self, path, connected: bool) -> None:
+        if self.connected_devices is None:
+            return
+        if connected:
+            self.connected_devices.add(path)
+        else:
+            self.connected_devices.discard(path)
+
+    def _device_properties_changed(self, interface, changed, invalidated, path=None) -> None:
+        if 'Connected' in changed:
+            self._set_connected(path, bool(changed['Connected']))
+
+    def _interfaces_added(self, path, interfaces) -> None:
+        if DEVICE_IFACE in interfaces:
+            self._set_connected(path, bool(interfaces[DEVICE_IFACE].get('Connected', False)))
+
+    def _interfaces_removed(self, path, interfaces) -> None:
+        if DEVICE_IFACE in interfaces:
+            self._set_connected(path, False)
+
+    def central_subscribed(self) -> None:
+        # a StartNotify proves some central is connected; if we haven't seen it,
+        # our view is incomplete, so stop holding notifications back
+        if self.connected_devices is not None and not self.connected_devices:
+            self.connected_devices = None
+
+    def has_connected_devices(self) -> bool:
+        return self.connected_devices is None or len(self.connected_devices) > 0
+
+    # one timer drives the notifications of every characteristic, and only runs
+    # while at least one of them is notifying
+    def start_notify_timer(self) -> None:
+        if self.notify_timer_id is None:
+            self.notify_timer_id = self.add_timeout(NOTIFY_TIMEOUT, self._tick)
+
+    def stop_notify_timer_if_idle(self) -> None:
+        if self.notify_timer_id is None:
+            return
+        if not any(chrc.notifying for chrc in self.characteristics):
+            self.remove_timeout(self.notify_timer_id)
+            self.notify_timer_id = None
+
     def pause_volume_update(self) -> None:
-        self.volume_update_paused_until = time() + 5
+        self.cancel_volume_resume()
+        self.volume_update_paused = True
+        self.resume_timer_id = self.add_timeout(5000, self._auto_resume_volume_update)
 
     def resume_volume_update(self) -> None:
-        self.volume_update_paused_until = 0
+        self.cancel_volume_resume()
+        self.volume_update_paused = False
+
+    def cancel_volume_resume(self) -> None:
+        if self.resume_timer_id is not None:
+            self.remove_timeout(self.resume_timer_id)
+            self.resume_timer_id = None
+
+    def _auto_resume_volume_update(self) -> bool:
+        self.resume_timer_id = None
+        self.volume_update_paused = False
+        return False
 
     def is_volume_update_paused(self) -> bool:
-        return time() < self.volume_update_paused_until
+        return self.volume_update_paused
+
+    def _tick(self) -> bool:
+        if not self.has_connected_devices():
+            # keep the timer and subscriptions, there is just nobody to send to
+            return True
+
+        updates = []
+        for chrc in self.characteristics:
+            if not chrc.notifying:
+                continue
+            skip = chrc.notify_skip
+            if skip > 0:
+                chrc.notify_skip = skip - 1
+                continue
+            # back off exponentially while the value is steady
+            value = chrc.pending_notification()
+            if value is not None:
+                updates.append((chrc, value))
+                backoff = 1
+            else:
+                backoff = min(chrc.notify_backoff * 2, MAX_NOTIFY_BACKOFF)
+            chrc.notify_backoff = backoff
+            chrc.notify_skip = backoff - 1
+
+        # read everything first, then send the signals back to back so they
+        # reach the bus together
+        for chrc, value in updates:
+            chrc.emit_value(value)
+        return True
 
 
 class NsCharacteristic(Characteristic):
     service: NsService
+    notifying = False
+    # number of timer ticks between checks, and ticks left until the next one
+    notify_backoff = 1
+    notify_skip = 0
+    # notify when the value moves by more than MIN_CHANGE plus MIN_RELATIVE_CHANGE of the last sent value
+    MIN_CHANGE = 0.0
+    MIN_RELATIVE_CHANGE = 0.0
+
+    # the last formatted value and its encoding, reused while the value is unchanged
+    _last_formatted: 'bytes | None' = None
+    _last_encoded: 'dbus.ByteArray | None' = None
 
     def __init__(self, uuid, flags, service: NsService):
         super().__init__(uuid, flags, service)
+        # bind the signal and its interface, already as a D-Bus string, once rather than on every emission
+        self._properties_changed = partial(self.PropertiesChanged, dbus.String(GATT_CHRC_IFACE))
+
+    def encode_cached(self, formatted: bytes) -> dbus.ByteArray:
+        # numbers are formatted straight to ASCII bytes, so no str or codec is involved
+        if formatted != self._last_formatted:
+            self._last_formatted = formatted
+            self._last_encoded = dbus.ByteArray(formatted)
+        return self._last_encoded
+
+    def emit_value(self, value: dbus.ByteArray) -> None:
+        self._properties_changed(dbus.Dictionary({'Value': value}, signature='sv'), NO_INVALIDATED)
+
+    def pending_notification(self) -> 'dbus.ByteArray | None':
+        # called from the service's notify tick; returns the payload to send, or None
+        # if the value hasn't moved enough since the last notification
+        num = self.get_float()
+        if should_notify(self.previous, num, self.MIN_CHANGE, self.MIN_RELATIVE_CHANGE):
+            self.previous = num
+            # only format and encode the reading when it actually gets sent
+            return self.encode_value(num)
+
+        return None
 
 
 class BrightnessCharacteristic(NsCharacteristic):
     CHARACTERISTIC_UUID = '00000001-b1b6-417b-af10-da8b3de984be'
+    MIN_CHANGE = 0.05
+    MIN_RELATIVE_CHANGE = 0.01
 
     def __init__(self, service):
         self.notifying = False
         self.previous = 100000000
-        self.last_notify = time()
 
         super().__init__(
                 self.CHARACTERISTIC_UUID,
@@ -104,42 +255,47 @@ class BrightnessCharacteristic(NsCharacteristic):
         self.add_descriptor(TextDescriptor(self, 'Brightness (lux)'))
 
     @staticmethod
-    def get() -> 'list[dbus.Byte]':
+    def get_float() -> float:
+        return brightness_sensor.get()
+
+    def encode_value(self, value: float) -> dbus.ByteArray:
+        logger.debug('read brightness: %.5g', value)
+        return self.encode_cached(b'%.5g' % value)  # 5 significant figures
+
+    def get(self) -> dbus.ByteArray:
         # get brightness
         try:
-            value = brightness_sensor.get()
-            str_value = f'{value:.5g}'  # 5 significant figures
-            if verbose:
-                print(f'read brightness: {str_value}')
-            return encode(f'{str_value}')
+            return self.encode_value(self.get_float())
         except Exception as e:
             print('error reading brightness')
             print(e)
             return encode('error')
 
-    def notify(self) -> bool:
-        if self.notifying and time() - self.last_notify > 0.2:
-            value = self.get()
-            num = float(decode(value))
-            if abs(self.previous - num) > 0.05 + (0.01 * self.previous):
-                self.PropertiesChanged(GATT_CHRC_IFACE, {'Value': value}, [])
-                self.previous = num
-                self.last_notify = time()
-
-        return self.notifying
-
     def StartNotify(self):
         if self.notifying:
             return
 
         self.notifying = True
+        self.notify_backoff = 1
+        self.notify_skip = 0
 
-        value = self.get()
-        self.PropertiesChanged(GATT_CHRC_IFACE, {'Value': value}, [])
-        self.add_timeout(NOTIFY_TIMEOUT, self.notify)
+        # send the current reading, and measure the next ticks against it
+        try:
+            num = self.get_float()
+        except Exception as e:
+            print('error reading brightness')
+            print(e)
+            value = encode('error')
+        else:
+            self.previous = num
+            value = self.encode_value(num)
+        self.emit_value(value)
+        self.service.central_subscribed()
+        self.service.start_notify_timer()
 
     def StopNotify(self):
         self.notifying = False
+        self.service.stop_notify_timer_if_idle()
 
     def ReadValue(self, options):
         value = self.get()
@@ -149,60 +305,61 @@ class BrightnessCharacteristic(NsCharacteristic):
 
 class VolumeCharacteristic(NsCharacteristic):
     CHARACTERISTIC_UUID = '00000002-b1b6-417b-af10-da8b3de984be'
+    MIN_CHANGE = 0.5
 
     def __init__(self, service):
         self.notifying = False
-        self.volume_value = self.get_raw()
+        self.volume_value: float = volume_sensor.get()
         self.previous = 100000000
-        self.last_notify = time()
 
         super().__init__(
                 self.CHARACTERISTIC_UUID,
                 ['notify', 'read'], service)
         self.add_descriptor(TextDescriptor(self, 'Volume (unit?)'))
 
-    @staticmethod
-    def get_raw() -> 'list[dbus.Byte]':
+    def get_float(self) -> float:
+        if not self.service.is_volume_update_paused():
+            self.volume_value = volume_sensor.get()
+        return self.volume_value
+
+    def encode_value(self, value: float) -> dbus.ByteArray:
+        logger.debug('read volume: %.1f', value)
+        return self.encode_cached(b'%.1f' % value)  # decibels, one decimal place
+
+    def get(self) -> dbus.ByteArray:
         # get volume
         try:
-            value = volume_sensor.get()
-            str_value = f'{value:.5g}'  # 5 significant figures
-            if verbose:
-                print(f'read volume: {str_value}')
-            return encode(f'{str_value}')
+            return self.encode_value(self.get_float())
         except Exception as e:
             print('error reading volume')
             print(e)
             return encode('error')
 
-    def get(self) -> 'list[dbus.Byte]':
-        if not self.service.is_volume_update_paused():
-            self.volume_value = self.get_raw()
-        return self.volume_value
-
-    def notify(self) -> bool:
-        if self.notifying and time() - self.last_notify > 0.2:
-            value = self.get()
-            num = float(decode(value))
-            if abs(self.previous - num) > 0.5:
-                self.PropertiesChanged(GATT_CHRC_IFACE, {'Value': value}, [])
-                self.previous = num
-                self.last_notify = time()
-
-        return self.notifying
-
     def StartNotify(self):
         if self.notifying:
             return
 
         self.notifying = True
+        self.notify_backoff = 1
+        self.notify_skip = 0
 
-        value = self.get()
-        self.PropertiesChanged(GATT_CHRC_IFACE, {'Value': value}, [])
-        self.add_timeout(NOTIFY_TIMEOUT, self.notify)
+        # send the current reading, and measure the next ticks against it
+        try:
+            num = self.get_float()
+        except Exception as e:
+            print('error reading volume')
+            print(e)
+            value = encode('error')
+        else:
+            self.previous = num
+            value = self.encode_value(num)
+        self.emit_value(value)
+        self.service.central_subscribed()
+        self.service.start_notify_timer()
 
     def StopNotify(self):
         self.notifying = False
+        self.service.stop_notify_timer_if_idle()
 
     def ReadValue(self, options):
         value = self.get()
@@ -223,12 +380,16 @@ class PauseVolumeUpdateCharacteristic(NsCharacteristic):
 
     def WriteValue(self, value, options):
         try:
-            num = float(decode(value))
-            print('received', num)
-            was_paused = self.service.is_volume_update_paused()
-            self.service.pause_volume_update()
-            if not was_paused:
-                self.service.volume.volume_value = value
+            # only 1 and 0 mean anything here, so compare the raw bytes instead of parsing a number
+            written = bytes(value)
+            print('received', written)
+            if written in (b'1', b'1.0'):
+                # the volume characteristic keeps its last reading while paused
+                self.service.pause_volume_update()
+            elif written in (b'0', b'0.0'):
+                self.service.resume_volume_update()
+            else:
+                raise ValueError(f'expected 1 or 0, got {written!r}')
         except Exception as e:
             print('error in WriteValue')
             print(e)
@@ -238,25 +399,28 @@ class PauseVolumeUpdateCharacteristic(NsCharacteristic):
 
 
 if __name__ == '__main__':
-    if any(sys.argv) in ['-v', '--verbose']:
-        verbose = True
+    if any(arg in ['-v', '--verbose'] for arg in sys.argv[1:]):
+        logging.basicConfig(level=logging.DEBUG)
 
     app = Application()
-    app.add_service(NsService(0))
-    app.register()
 
+    # both registrations are asynchronous D-Bus calls, so BlueZ handles them
+    # concurrently; only looking up BlueZ's objects blocks, so do it once
+    objects = BleTools.get_managed_objects(app.bus)
+    adapter = BleTools.find_adapter(app.bus, objects)
+
+    app.add_service(NsService(0, BleTools.find_connected_devices(objects)))
     adv = NsAdvertisement(0)
-    adv.register()
 
-    def stop():
-        app.quit()
-        brightness_sensor.stop()
-        volume_sensor.stop()
+    app.register(adapter)
+    adv.register(adapter)
+
+    # leave the main loop cleanly on Ctrl-C or kill, then release the sensors once
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: app.quit())
 
     try:
         app.run()
-    except KeyboardInterrupt:
-        stop()
-    except:
-        stop()
-        raise
+    finally:
+        brightness_sensor.stop()
+        volume_sensor.stop()